@@ -3,17 +3,29 @@
 # Builds the reasoning loop: agent_node → router → tool_node → loop back
 
 import os
+import time
+import asyncio
+import hashlib
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from functools import lru_cache
+from datetime import datetime
 from typing import Annotated, Literal
 from typing_extensions import TypedDict
 
 from langchain_groq import ChatGroq
-from langchain_core.messages import HumanMessage, AIMessage, SystemMessage, BaseMessage
+from langchain_core.messages import (
+    HumanMessage, AIMessage, SystemMessage, ToolMessage, BaseMessage,
+    trim_messages,
+)
+from langchain_core.messages.utils import count_tokens_approximately
+from langchain_core.runnables import RunnableLambda
 from langgraph.graph import StateGraph, END
 from langgraph.graph.message import add_messages
-from langgraph.prebuilt import ToolNode
 from dotenv import load_dotenv
 
-from agent.tools import ALL_TOOLS
+from agent.tools import ALL_TOOLS, current_session, _DRAFTS
+from vector_store.embeddings import encode_batch
 
 load_dotenv()
 
@@ -22,9 +34,11 @@ load_dotenv()
 #  This is the memory passed between every node
 #  add_messages appends new messages instead of
 #  overwriting — preserves full conversation history
+#  session_id scopes per-user data such as drafts
 # ══════════════════════════════════════════
 class AgentState(TypedDict):
     messages: Annotated[list[BaseMessage], add_messages]
+    session_id: str
 
 
 # ══════════════════════════════════════════
@@ -32,19 +46,28 @@ class AgentState(TypedDict):
 #  Binding tools lets the LLM emit tool_call
 #  objects instead of plain text when it wants
 #  to take an action
+#  Routing only needs to pick tools, so a small
+#  fast model drives the loop; the draft, summary
+#  and alert tools still call the 70B model
 # ══════════════════════════════════════════
-llm = ChatGroq(
+llm_router = ChatGroq(
     groq_api_key=os.getenv("GROQ_API_KEY"),
-    model_name="llama-3.3-70b-versatile",
+    model_name="llama-3.1-8b-instant",
     temperature=0,
+    streaming=True,
 )
 
-llm_with_tools = llm.bind_tools(ALL_TOOLS)
+# Sorted so the tool schema sent to Groq is byte-identical on every
+# request and across processes - keeps the prompt prefix cacheable
+llm_with_tools = llm_router.bind_tools(sorted(ALL_TOOLS, key=lambda t: t.name))
 
 
 # ══════════════════════════════════════════
 #  STEP 3 — System Prompt
 #  This tells the LLM who it is and how to behave
+#  Keep it static (no f-strings, no dates) so it
+#  stays a cacheable prefix; per-request details
+#  go in session_context() instead
 # ══════════════════════════════════════════
 SYSTEM_PROMPT = """You are Buraq, an intelligent Gmail assistant.
 You help the user manage their email without opening Gmail.
@@ -65,18 +88,50 @@ Critical rules:
    after user says 'send it' or 'yes send'
 3. Be concise, helpful, and conversational
 4. If unsure what the user wants, ask for clarification
+5. When you need multiple independent pieces of information,
+   emit all relevant tool calls in a single response so they
+   run in parallel
 """
 
 
+def session_context() -> SystemMessage:
+    """Dynamic context sent after the static system prompt."""
+    return SystemMessage(
+        content=f"Today's date is {datetime.now():%A, %Y-%m-%d}."
+    )
+
+
 # ══════════════════════════════════════════
 #  STEP 4 — Agent Node
 #  The brain of the loop
 #  Takes current state, calls LLM, returns next step
 #  LLM either calls a tool or gives final answer
+#  Only the most recent history is sent so the
+#  prompt size stays flat in long chats
 # ══════════════════════════════════════════
+MAX_HISTORY_TOKENS = 6000
+
+
 def agent_node(state: AgentState) -> AgentState:
+    recent_messages = trim_messages(
+        state["messages"],
+        token_counter=count_tokens_approximately,
+        strategy="last",
+        max_tokens=MAX_HISTORY_TOKENS,
+        include_system=False,
+        start_on="human",
+    )
+    if not recent_messages:
+        # The latest turn alone is over budget - still send it,
+        # from the last user message onwards, rather than nothing
+        last_human = max(
+            i for i, m in enumerate(state["messages"])
+            if isinstance(m, HumanMessage)
+        )
+        recent_messages = state["messages"][last_human:]
     messages_with_system = (
-        [SystemMessage(content=SYSTEM_PROMPT)] + state["messages"]
+        [SystemMessage(content=SYSTEM_PROMPT), session_context()]
+        + recent_messages
     )
     response = llm_with_tools.invoke(messages_with_system)
     return {"messages": [response]}
@@ -84,10 +139,68 @@ def agent_node(state: AgentState) -> AgentState:
 
 # ══════════════════════════════════════════
 #  STEP 5 — Tool Node
-#  Executes whatever tool the LLM picked
-#  Returns the result as a ToolMessage
+#  Executes every tool the LLM picked concurrently
+#  Returns one ToolMessage per tool call
+#  The tools are async; sync callers such as
+#  buraq_agent.invoke() get a wrapper that runs
+#  them on their own event loop
 # ══════════════════════════════════════════
-tool_node = ToolNode(tools=ALL_TOOLS)
+_TOOL_MAP = {t.name: t for t in ALL_TOOLS}
+
+# Used to run a coroutine when the caller's thread
+# already has an event loop running
+_sync_runner = ThreadPoolExecutor(max_workers=4)
+
+
+def _run_sync(coro):
+    """Runs a coroutine to completion from synchronous code."""
+    try:
+        asyncio.get_running_loop()
+    except RuntimeError:
+        return asyncio.run(coro)
+    # asyncio.run() can't nest inside a running loop, so give the
+    # coroutine a fresh loop on a worker thread and wait for it
+    return _sync_runner.submit(asyncio.run, coro).result()
+
+
+async def _run_tool(call: dict):
+    tool = _TOOL_MAP.get(call["name"])
+    if tool is None:
+        raise ValueError(f"Unknown tool: {call['name']}")
+    return await tool.ainvoke(call["args"])
+
+
+async def _atool_node(state: AgentState) -> AgentState:
+    tool_calls = state["messages"][-1].tool_calls
+    # Tasks created by gather copy this context, so every tool
+    # sees the session it is running for
+    current_session.set(state.get("session_id", "default"))
+    results = await asyncio.gather(
+        *(_run_tool(call) for call in tool_calls),
+        return_exceptions=True,
+    )
+
+    tool_messages = []
+    for call, result in zip(tool_calls, results):
+        if isinstance(result, Exception):
+            content = f"Error: {result!r}\n Please fix your mistakes."
+        else:
+            content = str(result)
+        tool_messages.append(
+            ToolMessage(
+                content=content,
+                name=call["name"],
+                tool_call_id=call["id"],
+            )
+        )
+    return {"messages": tool_messages}
+
+
+def _tool_node_sync(state: AgentState) -> AgentState:
+    return _run_sync(_atool_node(state))
+
+
+tool_node = RunnableLambda(_tool_node_sync, afunc=_atool_node, name="tools")
 
 
 # ══════════════════════════════════════════
@@ -106,7 +219,9 @@ def router(state: AgentState) -> Literal["tools", "__end__"]:
 # ══════════════════════════════════════════
 #  STEP 7 — Build the Graph
 #  Wire everything together
+#  Compiled once per process and shared
 # ══════════════════════════════════════════
+@lru_cache(maxsize=1)
 def build_graph():
     graph = StateGraph(AgentState)
 
@@ -138,19 +253,185 @@ buraq_agent = build_graph()
 
 
 # ══════════════════════════════════════════
-#  Public chat function
+#  Response Cache
+#  Repeated or reworded questions within a short
+#  window reuse the previous answer instead of
+#  running the full agent loop again
 # ══════════════════════════════════════════
-def chat(user_message: str, history: list = None) -> str:
+CACHE_TTL_SECONDS = 60
+CACHE_SIMILARITY_THRESHOLD = 0.95
+
+# Requests that draft or send email must always reach the agent,
+# as must anything said while a draft is waiting for approval
+_UNCACHEABLE_WORDS = ("send", "draft", "write", "compose", "revise", "reply")
+
+# Entries are (embedding, history_key, answer, created_at)
+_response_cache = []
+_response_cache_lock = threading.Lock()
+
+
+def _history_key(session_id: str, history: list) -> str:
+    recent = "\x1e".join(
+        [session_id] + [str(m.content) for m in history[-2:]]
+    )
+    return hashlib.sha256(recent.encode()).hexdigest()
+
+
+def _lookup_keys(session_id: str, history: list, embedding) -> set:
+    # An answer is stored under the history it was asked with. By
+    # the next turn that question and its answer have been appended,
+    # so also try the history from before the latest exchange -
+    # unless the user is re-sending their last message, which is a
+    # retry and should get a fresh answer
+    keys = {_history_key(session_id, history)}
+    last_human = next(
+        (m for m in reversed(history) if isinstance(m, HumanMessage)), None
+    )
+    if last_human is not None:
+        last_embedding = encode_batch([str(last_human.content)])[0]
+        if float(last_embedding @ embedding) >= CACHE_SIMILARITY_THRESHOLD:
+            return keys
+    keys.add(_history_key(session_id, history[:-2]))
+    return keys
+
+
+def _is_cacheable(user_message: str, session_id: str) -> bool:
+    # "yes" or "go ahead" may be confirming a pending draft
+    if session_id in _DRAFTS:
+        return False
+    text = user_message.lower()
+    return not any(word in text for word in _UNCACHEABLE_WORDS)
+
+
+def _cache_get(embedding, history_keys: set):
+    now = time.monotonic()
+    with _response_cache_lock:
+        _response_cache[:] = [
+            entry for entry in _response_cache
+            if now - entry[3] < CACHE_TTL_SECONDS
+        ]
+        for cached_embedding, key, answer, _ in _response_cache:
+            if key not in history_keys:
+                continue
+            # Embeddings are normalised, so the dot product is cosine
+            if float(cached_embedding @ embedding) >= CACHE_SIMILARITY_THRESHOLD:
+                return answer
+    return None
+
+
+def _cache_put(embedding, history_key: str, answer: str):
+    with _response_cache_lock:
+        _response_cache.append(
+            (embedding, history_key, answer, time.monotonic())
+        )
+
+
+# ══════════════════════════════════════════
+#  Public chat functions
+#  stream_chat yields (step, token) pairs as the
+#  LLM writes them; chat collects the final answer
+# ══════════════════════════════════════════
+async def _astream_reply(user_message: str, history: list, session_id: str):
     """
-    Main entry point to talk to Buraq.
-    Maintains conversation history for multi-turn context.
+    Yields (step, token) pairs for text written by the agent node.
+    Each agent turn has its own step and starts with an empty token,
+    even if it writes no text; the final answer is the text of the
+    last step. Cache hits come back as one token.
     """
-    if history is None:
-        history = []
+    cacheable = _is_cacheable(user_message, session_id)
+    if cacheable:
+        embedding = encode_batch([user_message])[0]
+        history_key = _history_key(session_id, history)
+        cached = _cache_get(
+            embedding, _lookup_keys(session_id, history, embedding)
+        )
+        if cached is not None:
+            yield 0, cached
+            return
 
     input_messages = history + [HumanMessage(content=user_message)]
-    result = buraq_agent.invoke({"messages": input_messages})
-    return result["messages"][-1].content
+    answer_parts = []
+    last_step = None
+    async for chunk, metadata in buraq_agent.astream(
+        {"messages": input_messages, "session_id": session_id},
+        stream_mode="messages",
+    ):
+        if metadata.get("langgraph_node") != "agent":
+            continue
+        step = metadata.get("langgraph_step")
+        if step != last_step:
+            # A turn that only calls tools must still replace
+            # the text of the turn before it
+            answer_parts = []
+            last_step = step
+            yield step, ""
+        if not chunk.content:
+            continue
+        answer_parts.append(chunk.content)
+        yield step, chunk.content
+
+    answer = "".join(answer_parts)
+    # A draft created during this turn makes the answer stateful too
+    if cacheable and answer and session_id not in _DRAFTS:
+        _cache_put(embedding, history_key, answer)
+
+
+async def stream_chat(
+    user_message: str, history: list = None, session_id: str = "default"
+):
+    """
+    Streams Buraq's reply token by token so a UI can show
+    the answer while it is still being generated.
+    Yields (step, token) pairs. When step changes the agent has
+    started a new turn, so the UI should replace what it has shown;
+    that new turn's first token may be empty. The text of the last
+    step is the same answer chat() returns.
+    """
+    async for step, token in _astream_reply(
+        user_message, history or [], session_id
+    ):
+        yield step, token
+
+
+async def _areply(user_message, history, session_id, on_token=None) -> str:
+    """
+    Returns the text of the agent's last turn, or "" if it wrote none.
+    on_token, if given, is called with (step, token) for every token.
+    """
+    answer_parts = []
+    last_step = None
+    async for step, token in _astream_reply(user_message, history, session_id):
+        if step != last_step:
+            answer_parts = []
+            last_step = step
+        if not token:
+            continue
+        if on_token is not None:
+            on_token(step, token)
+        answer_parts.append(token)
+    return "".join(answer_parts)
+
+
+async def achat(
+    user_message: str, history: list = None, session_id: str = "default"
+) -> str:
+    """
+    Async version of chat() for callers already running
+    an event loop, such as an async web server.
+    """
+    return await _areply(user_message, history or [], session_id)
+
+
+def chat(
+    user_message: str, history: list = None, session_id: str = "default"
+) -> str:
+    """
+    Main entry point to talk to Buraq.
+    Maintains conversation history for multi-turn context.
+    session_id keeps drafts separate between users.
+    """
+    # The tool node is async, so the graph must run on an event loop
+    return _run_sync(achat(user_message, history, session_id))
 
 
 # ══════════════════════════════════════════
@@ -163,6 +444,17 @@ if __name__ == "__main__":
     print("Type 'exit' to quit\n")
 
     history = []
+    printed_step = None
+
+    def print_token(step, token):
+        # Text from an earlier agent turn (before a tool call)
+        # goes on its own line, apart from the final answer
+        global printed_step
+        if printed_step is not None and step != printed_step:
+            print()
+        printed_step = step
+        print(token, end="", flush=True)
+
     while True:
         user_input = input("You: ").strip()
         if user_input.lower() in ["exit", "quit"]:
@@ -171,10 +463,13 @@ if __name__ == "__main__":
         if not user_input:
             continue
 
-        print("\nBuraq: thinking...\n")
-        response = chat(user_input, history)
-        print(f"Buraq: {response}\n")
+        print("\nBuraq: ", end="", flush=True)
+        printed_step = None
+        response = asyncio.run(_areply(
+            user_input, history, "default", on_token=print_token,
+        ))
+        print("\n")
         print("-" * 40)
 
         history.append(HumanMessage(content=user_input))
-        history.append(AIMessage(content=response))
\ No newline at end of file
+        history.append(AIMessage(content=response))
@@ -5,9 +5,15 @@
 
 import os
 import re
-import pickle
+import time
+import asyncio
+import threading
 import base64
+from functools import lru_cache, wraps
+from contextvars import ContextVar
+from concurrent.futures import ThreadPoolExecutor
 from datetime import datetime, timedelta
+from email.charset import Charset, QP
 from email.mime.text import MIMEText
 from typing import Optional
 
@@ -15,30 +21,49 @@ from pydantic import BaseModel, Field, field_validator
 from langchain_core.tools import tool
 from dotenv import load_dotenv
 
+import httplib2
+import google_auth_httplib2
 from googleapiclient.discovery import build
+from googleapiclient.http import HttpRequest
 from google_auth_oauthlib.flow import InstalledAppFlow
 from google.auth.transport.requests import Request
-from groq import Groq
+from google.oauth2.credentials import Credentials
+from groq import AsyncGroq
 
 # Import our Lab 2 grounding tool
 from vector_store.search import search_knowledge_base as kb_search
+# Gmail rate-limits batches bigger than 50 sub-requests
+from vector_store.ingest import GMAIL_BATCH_SIZE
+from vector_store.fileio import atomic_write_text
 
 load_dotenv()
 
 SCOPES = ["https://www.googleapis.com/auth/gmail.modify"]
 
+# Drafts waiting for approval, keyed by chat session.
+# The graph sets current_session before running tools.
+_DRAFTS: dict[str, dict] = {}
+current_session: ContextVar[str] = ContextVar(
+    "current_session", default="default"
+)
+
 
 # ─────────────────────────────────────────
 #  Gmail Auth Helper
 # ─────────────────────────────────────────
-def get_gmail_service():
+TOKEN_PATH = "token.json"
+
+
+def _save_credentials(creds):
+    atomic_write_text(TOKEN_PATH, creds.to_json())
+
+
+def _load_credentials():
     creds = None
-    token_path = "token.pickle"
     creds_path = os.getenv("GOOGLE_CLIENT_SECRET_FILE", "credentials.json")
 
-    if os.path.exists(token_path):
-        with open(token_path, "rb") as f:
-            creds = pickle.load(f)
+    if os.path.exists(TOKEN_PATH):
+        creds = Credentials.from_authorized_user_file(TOKEN_PATH)
 
     if not creds or not creds.valid:
         if creds and creds.expired and creds.refresh_token:
@@ -46,14 +71,136 @@ def get_gmail_service():
         else:
             flow = InstalledAppFlow.from_client_secrets_file(creds_path, SCOPES)
             creds = flow.run_local_server(port=0)
-        with open(token_path, "wb") as f:
-            pickle.dump(creds, f)
+        _save_credentials(creds)
+
+    return creds
 
-    return build("gmail", "v1", credentials=creds)
+
+@lru_cache(maxsize=1)
+def _gmail_client():
+    """
+    Builds the Gmail client once per process.
+    httplib2 is not thread-safe, so every request gets its own
+    authorised Http object; the service itself can then be shared
+    by tools running in parallel threads.
+    """
+    creds = _load_credentials()
+
+    def build_request(http, *args, **kwargs):
+        new_http = google_auth_httplib2.AuthorizedHttp(
+            creds, http=httplib2.Http()
+        )
+        return HttpRequest(new_http, *args, **kwargs)
+
+    service = build(
+        "gmail", "v1",
+        http=google_auth_httplib2.AuthorizedHttp(creds, http=httplib2.Http()),
+        requestBuilder=build_request,
+    )
+    return creds, service
+
+
+# Tools call get_gmail_service() from several threads at once;
+# only one of them should run the OAuth flow or refresh the token
+_gmail_lock = threading.Lock()
+
+
+def get_gmail_service():
+    with _gmail_lock:
+        creds, service = _gmail_client()
+        # Keep the cached client usable across long sessions
+        if creds.expired and creds.refresh_token:
+            creds.refresh(Request())
+            _save_credentials(creds)
+    return service
 
 
 def get_llm():
-    return Groq(api_key=os.getenv("GROQ_API_KEY"))
+    # Use as "async with get_llm() as client:" so the HTTP pool is
+    # closed on the event loop that opened it - chat() runs every
+    # turn on a fresh loop, and a client left open outlives it
+    return AsyncGroq(api_key=os.getenv("GROQ_API_KEY"))
+
+
+# Shared across tools so batch chunks run in parallel without
+# creating new threads on every call
+_EXECUTOR = ThreadPoolExecutor(max_workers=10)
+
+
+def _fetch_messages_batch(
+    service, ids, headers_wanted, fields="snippet,payload/headers"
+):
+    """
+    Fetches metadata for many messages in as few HTTP round-trips
+    as possible using Gmail's batch endpoint. Only the snippet and
+    the requested headers are downloaded - never the message body.
+    Returns (headers_dict, snippet) tuples in the same order as ids.
+    Messages that fail to load are skipped.
+    """
+    results = [None] * len(ids)
+
+    def _collect(request_id, response, exception):
+        if exception is not None:
+            return
+        headers = {
+            h["name"]: h["value"]
+            for h in response.get("payload", {}).get("headers", [])
+        }
+        results[int(request_id)] = (headers, response.get("snippet", ""))
+
+    def _execute_chunk(start):
+        batch = service.new_batch_http_request(callback=_collect)
+        for i, msg_id in enumerate(ids[start:start + GMAIL_BATCH_SIZE]):
+            batch.add(
+                service.users().messages().get(
+                    userId="me",
+                    id=msg_id,
+                    format="metadata",
+                    metadataHeaders=headers_wanted,
+                    fields=fields,
+                ),
+                request_id=str(start + i),
+            )
+        batch.execute()
+
+    # Each chunk is one HTTP round-trip; overlap them when there
+    # are more ids than fit in a single batch
+    list(_EXECUTOR.map(_execute_chunk, range(0, len(ids), GMAIL_BATCH_SIZE)))
+
+    return [r for r in results if r is not None]
+
+
+# Read-only tool results are reused for a few seconds so repeated
+# "any new emails?" questions don't hit Gmail every time
+TOOL_CACHE_TTL = 15
+TOOL_CACHE_MAXSIZE = 128
+_tool_cache: dict = {}
+_tool_cache_lock = threading.Lock()
+
+
+def _cached_with_ttl(fn):
+    """Caches an async tool's result per (tool, arguments)."""
+    @wraps(fn)
+    async def wrapper(*args, **kwargs):
+        key = (fn.__name__, args, tuple(sorted(kwargs.items())))
+        with _tool_cache_lock:
+            hit = _tool_cache.get(key)
+        if hit is not None and time.monotonic() - hit[1] < TOOL_CACHE_TTL:
+            return hit[0]
+
+        result = await fn(*args, **kwargs)
+
+        now = time.monotonic()
+        with _tool_cache_lock:
+            if len(_tool_cache) >= TOOL_CACHE_MAXSIZE:
+                for k in [k for k, v in _tool_cache.items()
+                          if now - v[1] >= TOOL_CACHE_TTL]:
+                    del _tool_cache[k]
+            if len(_tool_cache) >= TOOL_CACHE_MAXSIZE:
+                del _tool_cache[next(iter(_tool_cache))]
+            _tool_cache[key] = (result, now)
+        return result
+    return wrapper
 
 
 # ══════════════════════════════════════════
@@ -66,35 +213,36 @@ class ReadInboxInput(BaseModel):
     )
 
 @tool(args_schema=ReadInboxInput)
-def read_inbox(max_results: int = 5) -> str:
+@_cached_with_ttl
+async def read_inbox(max_results: int = 5) -> str:
     """
     Reads the user's Gmail inbox and returns recent emails.
     Use this when the user asks to check their email, see
     their inbox, or asks what emails they have received.
     """
-    service = get_gmail_service()
-    results = service.users().messages().list(
-        userId="me", labelIds=["INBOX"], maxResults=max_results
-    ).execute()
+    service = await asyncio.to_thread(get_gmail_service)
+    results = await asyncio.to_thread(
+        service.users().messages().list(
+            userId="me", labelIds=["INBOX"], maxResults=max_results,
+            fields="messages/id"
+        ).execute
+    )
     messages = results.get("messages", [])
 
     if not messages:
         return "Your inbox is empty."
 
+    fetched = await asyncio.to_thread(
+        _fetch_messages_batch,
+        service, [m["id"] for m in messages], ["From", "Subject", "Date"]
+    )
     output = []
-    for msg in messages:
-        data = service.users().messages().get(
-            userId="me", id=msg["id"]
-        ).execute()
-        headers = {
-            h["name"]: h["value"]
-            for h in data["payload"]["headers"]
-        }
+    for headers, snippet in fetched:
         output.append(
             f"From: {headers.get('From', 'Unknown')}\n"
             f"Subject: {headers.get('Subject', 'No Subject')}\n"
             f"Date: {headers.get('Date', '')}\n"
-            f"Preview: {data.get('snippet', '')[:100]}\n"
+            f"Preview: {snippet[:100]}\n"
         )
     return "\n---\n".join(output)
 
@@ -109,34 +257,35 @@ class SearchEmailInput(BaseModel):
     max_results: int = Field(default=5, ge=1, le=20)
 
 @tool(args_schema=SearchEmailInput)
-def search_emails(query: str, max_results: int = 5) -> str:
+@_cached_with_ttl
+async def search_emails(query: str, max_results: int = 5) -> str:
     """
     Searches Gmail using a query and returns matching emails.
     Use this when the user wants to find a specific email
     by sender, subject, or keyword.
     """
-    service = get_gmail_service()
-    results = service.users().messages().list(
-        userId="me", q=query, maxResults=max_results
-    ).execute()
+    service = await asyncio.to_thread(get_gmail_service)
+    results = await asyncio.to_thread(
+        service.users().messages().list(
+            userId="me", q=query, maxResults=max_results,
+            fields="messages/id"
+        ).execute
+    )
     messages = results.get("messages", [])
 
     if not messages:
         return f"No emails found for: '{query}'"
 
+    fetched = await asyncio.to_thread(
+        _fetch_messages_batch,
+        service, [m["id"] for m in messages], ["From", "Subject"]
+    )
     output = []
-    for msg in messages:
-        data = service.users().messages().get(
-            userId="me", id=msg["id"]
-        ).execute()
-        headers = {
-            h["name"]: h["value"]
-            for h in data["payload"]["headers"]
-        }
+    for headers, snippet in fetched:
         output.append(
             f"From: {headers.get('From', 'Unknown')}\n"
             f"Subject: {headers.get('Subject', 'No Subject')}\n"
-            f"Preview: {data.get('snippet', '')[:100]}\n"
+            f"Preview: {snippet[:100]}\n"
         )
     return "\n---\n".join(output)
 
@@ -159,36 +308,37 @@ class FetchByDateInput(BaseModel):
         return v
 
 @tool(args_schema=FetchByDateInput)
-def fetch_emails_by_date(date: str) -> str:
+@_cached_with_ttl
+async def fetch_emails_by_date(date: str) -> str:
     """
     Fetches all emails received on a specific date.
     Use this when the user asks for emails from a
     particular day e.g. 'show emails from June 1st'.
     """
-    service = get_gmail_service()
+    service = await asyncio.to_thread(get_gmail_service)
     dt = datetime.strptime(date, "%Y-%m-%d")
     after = int(dt.timestamp())
     before = int((dt + timedelta(days=1)).timestamp())
 
-    results = service.users().messages().list(
-        userId="me",
-        q=f"after:{after} before:{before}",
-        maxResults=20
-    ).execute()
+    results = await asyncio.to_thread(
+        service.users().messages().list(
+            userId="me",
+            q=f"after:{after} before:{before}",
+            maxResults=20,
+            fields="messages/id"
+        ).execute
+    )
     messages = results.get("messages", [])
 
     if not messages:
         return f"No emails found for {date}."
 
+    fetched = await asyncio.to_thread(
+        _fetch_messages_batch,
+        service, [m["id"] for m in messages], ["From", "Subject"]
+    )
     output = [f"Emails received on {date}:\n"]
-    for msg in messages:
-        data = service.users().messages().get(
-            userId="me", id=msg["id"]
-        ).execute()
-        headers = {
-            h["name"]: h["value"]
-            for h in data["payload"]["headers"]
-        }
+    for headers, _ in fetched:
         output.append(
             f"From: {headers.get('From', 'Unknown')} | "
             f"Subject: {headers.get('Subject', 'No Subject')}"
@@ -216,7 +366,7 @@ class DraftEmailInput(BaseModel):
         return v.strip()
 
 @tool(args_schema=DraftEmailInput)
-def draft_email(
+async def draft_email(
     to: str, subject: str, context: str, tone: str = "professional"
 ) -> str:
     """
@@ -225,36 +375,36 @@ def draft_email(
     Always show the draft to the user BEFORE sending.
     Never send without user approval.
     """
-    client = get_llm()
-    response = client.chat.completions.create(
-        model="llama-3.3-70b-versatile",
-        messages=[
-            {
-                "role": "system",
-                "content": (
-                    "You are an expert email writer. "
-                    "Write a complete, well-structured email. "
-                    "Start directly with the greeting. "
-                    "No preamble or explanation."
-                )
-            },
-            {
-                "role": "user",
-                "content": (
-                    f"Write a {tone} email.\n"
-                    f"To: {to}\n"
-                    f"Subject: {subject}\n"
-                    f"Instructions: {context}"
-                )
-            }
-        ]
-    )
+    async with get_llm() as client:
+        response = await client.chat.completions.create(
+            model="llama-3.3-70b-versatile",
+            messages=[
+                {
+                    "role": "system",
+                    "content": (
+                        "You are an expert email writer. "
+                        "Write a complete, well-structured email. "
+                        "Start directly with the greeting. "
+                        "No preamble or explanation."
+                    )
+                },
+                {
+                    "role": "user",
+                    "content": (
+                        f"Write a {tone} email.\n"
+                        f"To: {to}\n"
+                        f"Subject: {subject}\n"
+                        f"Instructions: {context}"
+                    )
+                }
+            ]
+        )
     body = response.choices[0].message.content.strip()
 
     # Save draft for later sending
-    draft = {"to": to, "subject": subject, "body": body}
-    with open(".draft_cache.pkl", "wb") as f:
-        pickle.dump(draft, f)
+    _DRAFTS[current_session.get()] = {
+        "to": to, "subject": subject, "body": body
+    }
 
     return (
         f"Draft Email:\n"
@@ -270,13 +420,29 @@ def draft_email(
 # ══════════════════════════════════════════
 #  TOOL 5 — Send Reviewed Email
 # ══════════════════════════════════════════
+def _build_mime(body: str) -> MIMEText:
+    """
+    Builds the message without a base64 body, since Gmail's raw
+    field is base64 encoded again anyway. Plain ASCII goes out as
+    7bit; anything else uses quoted-printable, which stays close to
+    the original size for mostly-Latin text.
+    """
+    # 7bit also requires every line to fit in 998 characters
+    if body.isascii() and all(len(line) <= 998 for line in body.splitlines()):
+        return MIMEText(body, "plain", "us-ascii")
+
+    charset = Charset("utf-8")
+    charset.body_encoding = QP
+    return MIMEText(body, "plain", charset)
+
+
 class SendReviewedInput(BaseModel):
     confirmed: bool = Field(
         description="Set True only when user explicitly says send it"
     )
 
 @tool(args_schema=SendReviewedInput)
-def send_reviewed_email(confirmed: bool) -> str:
+async def send_reviewed_email(confirmed: bool) -> str:
     """
     Sends the previously drafted email after user approval.
     Only call this when the user explicitly says 'send it',
@@ -286,22 +452,26 @@ def send_reviewed_email(confirmed: bool) -> str:
     if not confirmed:
         return "Email not sent. Please confirm by saying 'send it'."
 
-    if not os.path.exists(".draft_cache.pkl"):
+    session = current_session.get()
+    draft = _DRAFTS.get(session)
+    if draft is None:
         return "No draft found. Please draft an email first."
 
-    with open(".draft_cache.pkl", "rb") as f:
-        draft = pickle.load(f)
-
-    service = get_gmail_service()
-    message = MIMEText(draft["body"])
+    service = await asyncio.to_thread(get_gmail_service)
+    message = _build_mime(draft["body"])
     message["to"] = draft["to"]
     message["subject"] = draft["subject"]
     raw = base64.urlsafe_b64encode(message.as_bytes()).decode()
 
-    service.users().messages().send(
-        userId="me", body={"raw": raw}
-    ).execute()
-    os.remove(".draft_cache.pkl")
+    await asyncio.to_thread(
+        service.users().messages().send(
+            userId="me", body={"raw": raw}
+        ).execute
+    )
+    _DRAFTS.pop(session, None)
+    # The mailbox changed - don't serve stale results
+    with _tool_cache_lock:
+        _tool_cache.clear()
 
     return f"Email sent to {draft['to']} | Subject: '{draft['subject']}'"
 
@@ -311,6 +481,52 @@ def send_reviewed_email(confirmed: bool) -> str:
 #  Handles natural language like "yesterday",
 #  "last 2 days", "today", or YYYY-MM-DD
 # ══════════════════════════════════════════
+_DIGITS = re.compile(r"\d+")
+_RELATIVE_WORDS = ("last", "past", "recent")
+
+
+def _period_today():
+    end_time = datetime.now()
+    return end_time - timedelta(days=1), end_time
+
+
+def _period_yesterday():
+    end_time = datetime.now() - timedelta(days=1)
+    return end_time - timedelta(days=1), end_time
+
+
+# Exact phrases map straight to a handler, no string scanning needed
+_PERIOD_HANDLERS = {
+    "": _period_today,
+    "today": _period_today,
+    "yesterday": _period_yesterday,
+}
+
+
+def _resolve_period(date: Optional[str]):
+    """Turns a natural language date into a (start, end) datetime pair."""
+    d = (date or "").lower().strip()
+
+    handler = _PERIOD_HANDLERS.get(d)
+    if handler is not None:
+        return handler()
+
+    if any(word in d for word in _RELATIVE_WORDS):
+        # Extract number from "last 2 days", "past 3 days" etc.
+        match = _DIGITS.search(d)
+        days_back = int(match.group()) if match else 1
+        end_time = datetime.now()
+        return end_time - timedelta(days=days_back), end_time
+
+    # Try standard YYYY-MM-DD format
+    try:
+        start_time = datetime.strptime(d, "%Y-%m-%d")
+        return start_time, start_time + timedelta(days=1)
+    except ValueError:
+        # Fallback to today if format not recognised
+        return _period_today()
+
+
 class DailySummaryInput(BaseModel):
     date: Optional[str] = Field(
         default=None,
@@ -322,7 +538,8 @@ class DailySummaryInput(BaseModel):
     )
 
 @tool(args_schema=DailySummaryInput)
-def daily_email_summary(date: Optional[str] = None) -> str:
+@_cached_with_ttl
+async def daily_email_summary(date: Optional[str] = None) -> str:
     """
     Generates an AI summary of all emails received on a given day
     or over the last N days. Use this when the user asks for a
@@ -331,81 +548,58 @@ def daily_email_summary(date: Optional[str] = None) -> str:
     'today', 'yesterday', 'last 2 days', or YYYY-MM-DD format.
     """
     # Handle natural language date inputs
-    if date is None or date.lower().strip() in ["today", ""]:
-        end_time = datetime.now()
-        start_time = end_time - timedelta(days=1)
-
-    elif date.lower().strip() == "yesterday":
-        end_time = datetime.now() - timedelta(days=1)
-        start_time = end_time - timedelta(days=1)
-
-    elif any(word in date.lower() for word in ["last", "past", "recent"]):
-        # Extract number from "last 2 days", "past 3 days" etc.
-        numbers = re.findall(r'\d+', date)
-        days_back = int(numbers[0]) if numbers else 1
-        end_time = datetime.now()
-        start_time = end_time - timedelta(days=days_back)
-
-    else:
-        # Try standard YYYY-MM-DD format
-        try:
-            start_time = datetime.strptime(date.strip(), "%Y-%m-%d")
-            end_time = start_time + timedelta(days=1)
-        except ValueError:
-            # Fallback to today if format not recognised
-            end_time = datetime.now()
-            start_time = end_time - timedelta(days=1)
+    start_time, end_time = _resolve_period(date)
 
     after_ts = int(start_time.timestamp())
     before_ts = int(end_time.timestamp())
 
-    service = get_gmail_service()
-    results = service.users().messages().list(
-        userId="me",
-        q=f"after:{after_ts} before:{before_ts}",
-        maxResults=30
-    ).execute()
+    service = await asyncio.to_thread(get_gmail_service)
+    results = await asyncio.to_thread(
+        service.users().messages().list(
+            userId="me",
+            q=f"after:{after_ts} before:{before_ts}",
+            maxResults=30,
+            fields="messages/id"
+        ).execute
+    )
     messages = results.get("messages", [])
 
     if not messages:
         return "No emails received in the specified time period."
 
+    fetched = await asyncio.to_thread(
+        _fetch_messages_batch,
+        service, [m["id"] for m in messages], ["From", "Subject"]
+    )
     snippets = []
-    for msg in messages:
-        data = service.users().messages().get(
-            userId="me", id=msg["id"]
-        ).execute()
-        headers = {
-            h["name"]: h["value"]
-            for h in data["payload"]["headers"]
-        }
+    for headers, snippet in fetched:
         snippets.append(
             f"From: {headers.get('From','?')} | "
             f"Subject: {headers.get('Subject','?')} | "
-            f"{data.get('snippet','')[:100]}"
+            f"{snippet[:100]}"
         )
 
-    client = get_llm()
-    response = client.chat.completions.create(
-        model="llama-3.3-70b-versatile",
-        messages=[
-            {
-                "role": "system",
-                "content": (
-                    "You are Buraq, an intelligent email assistant. "
-                    "Summarise these emails as a clear daily digest. "
-                    "Use bullet points. Highlight anything urgent."
-                )
-            },
-            {
-                "role": "user",
-                "content": (
-                    f"Summarise these {len(snippets)} emails:\n\n"
-                    + "\n".join(snippets)
-                )
-            }
-        ]
-    )
+    async with get_llm() as client:
+        response = await client.chat.completions.create(
+            model="llama-3.3-70b-versatile",
+            messages=[
+                {
+                    "role": "system",
+                    "content": (
+                        "You are Buraq, an intelligent email assistant. "
+                        "Summarise these emails as a clear daily digest. "
+                        "Use bullet points. Highlight anything urgent."
+                    )
+                },
+                {
+                    "role": "user",
+                    "content": (
+                        f"Summarise these {len(snippets)} emails:\n\n"
+                        + "\n".join(snippets)
+                    )
+                }
+            ]
+        )
     return response.choices[0].message.content.strip()
 
 
@@ -416,29 +610,30 @@ class CheckSpamInput(BaseModel):
     max_results: int = Field(default=10, ge=1, le=50)
 
 @tool(args_schema=CheckSpamInput)
-def check_spam(max_results: int = 10) -> str:
+@_cached_with_ttl
+async def check_spam(max_results: int = 10) -> str:
     """
     Checks the Gmail spam folder and reports suspicious emails.
     Use this when user asks about spam or junk mail.
     """
-    service = get_gmail_service()
-    results = service.users().messages().list(
-        userId="me", labelIds=["SPAM"], maxResults=max_results
-    ).execute()
+    service = await asyncio.to_thread(get_gmail_service)
+    results = await asyncio.to_thread(
+        service.users().messages().list(
+            userId="me", labelIds=["SPAM"], maxResults=max_results,
+            fields="messages/id"
+        ).execute
+    )
     messages = results.get("messages", [])
 
     if not messages:
         return "No spam emails found."
 
+    fetched = await asyncio.to_thread(
+        _fetch_messages_batch,
+        service, [m["id"] for m in messages], ["From", "Subject"]
+    )
     output = [f"{len(messages)} spam email(s) detected:\n"]
-    for msg in messages:
-        data = service.users().messages().get(
-            userId="me", id=msg["id"]
-        ).execute()
-        headers = {
-            h["name"]: h["value"]
-            for h in data["payload"]["headers"]
-        }
+    for headers, _ in fetched:
         output.append(
             f"From: {headers.get('From','?')} | "
             f"Subject: {headers.get('Subject','?')}"
@@ -456,31 +651,43 @@ class CheckRepliesInput(BaseModel):
     )
 
 @tool(args_schema=CheckRepliesInput)
-def check_replies(hours_back: int = 24) -> str:
+@_cached_with_ttl
+async def check_replies(hours_back: int = 24) -> str:
     """
     Checks if anyone replied to the user's sent emails recently.
     Use this when user asks if anyone replied or responded to them.
     Accepts up to 720 hours (30 days) back.
     """
-    service = get_gmail_service()
+    service = await asyncio.to_thread(get_gmail_service)
     since = datetime.now() - timedelta(hours=hours_back)
     after_ts = int(since.timestamp())
 
-    results = service.users().messages().list(
-        userId="me",
-        q=f"in:inbox after:{after_ts}",
-        maxResults=20
-    ).execute()
+    # Gmail can't search on In-Reply-To, so narrow the list
+    # server-side to mail that could be a reply: not sent by the
+    # user and not bulk promotional/social mail
+    results = await asyncio.to_thread(
+        service.users().messages().list(
+            userId="me",
+            q=(
+                f"in:inbox after:{after_ts} -from:me "
+                "-category:promotions -category:social"
+            ),
+            maxResults=20,
+            fields="messages/id"
+        ).execute
+    )
     messages = results.get("messages", [])
 
+    # Only the headers are needed here, not the snippet
+    fetched = await asyncio.to_thread(
+        _fetch_messages_batch,
+        service, [m["id"] for m in messages],
+        ["From", "Subject", "In-Reply-To"],
+        "payload/headers",
+    )
     replies = []
-    for msg in messages:
-        data = service.users().messages().get(
-            userId="me", id=msg["id"]
-        ).execute()
-        headers_list = data["payload"]["headers"]
-        headers = {h["name"]: h["value"] for h in headers_list}
-        if any(h["name"] == "In-Reply-To" for h in headers_list):
+    for headers, _ in fetched:
+        if "In-Reply-To" in headers:
             replies.append(
                 f"From: {headers.get('From','?')} | "
                 f"Subject: {headers.get('Subject','?')}"
@@ -502,54 +709,55 @@ class ImportantAlertsInput(BaseModel):
     max_results: int = Field(default=10, ge=1, le=30)
 
 @tool(args_schema=ImportantAlertsInput)
-def check_important_alerts(max_results: int = 10) -> str:
+@_cached_with_ttl
+async def check_important_alerts(max_results: int = 10) -> str:
     """
     Scans inbox and uses AI to find urgent emails and deadlines.
     Use this when user asks what needs attention, any deadlines,
     or anything important in their inbox.
     """
-    service = get_gmail_service()
-    results = service.users().messages().list(
-        userId="me", labelIds=["INBOX"], maxResults=max_results
-    ).execute()
+    service = await asyncio.to_thread(get_gmail_service)
+    results = await asyncio.to_thread(
+        service.users().messages().list(
+            userId="me", labelIds=["INBOX"], maxResults=max_results,
+            fields="messages/id"
+        ).execute
+    )
     messages = results.get("messages", [])
 
     if not messages:
         return "No emails to analyse."
 
+    fetched = await asyncio.to_thread(
+        _fetch_messages_batch,
+        service, [m["id"] for m in messages], ["From", "Subject"]
+    )
     snippets = []
-    for msg in messages:
-        data = service.users().messages().get(
-            userId="me", id=msg["id"]
-        ).execute()
-        headers = {
-            h["name"]: h["value"]
-            for h in data["payload"]["headers"]
-        }
+    for headers, snippet in fetched:
         snippets.append(
             f"From: {headers.get('From','?')} | "
             f"Subject: {headers.get('Subject','?')} | "
-            f"{data.get('snippet','')[:120]}"
+            f"{snippet[:120]}"
         )
 
-    client = get_llm()
-    response = client.chat.completions.create(
-        model="llama-3.3-70b-versatile",
-        messages=[
-            {
-                "role": "system",
-                "content": (
-                    "You are Buraq. Analyse these emails and extract "
-                    "only urgent ones, deadlines, or action items. "
-                    "If nothing urgent, say so clearly."
-                )
-            },
-            {
-                "role": "user",
-                "content": "\n".join(snippets)
-            }
-        ]
-    )
+    async with get_llm() as client:
+        response = await client.chat.completions.create(
+            model="llama-3.3-70b-versatile",
+            messages=[
+                {
+                    "role": "system",
+                    "content": (
+                        "You are Buraq. Analyse these emails and extract "
+                        "only urgent ones, deadlines, or action items. "
+                        "If nothing urgent, say so clearly."
+                    )
+                },
+                {
+                    "role": "user",
+                    "content": "\n".join(snippets)
+                }
+            ]
+        )
     return response.choices[0].message.content.strip()
 
 
@@ -562,7 +770,8 @@ class SearchKBInput(BaseModel):
     )
 
 @tool(args_schema=SearchKBInput)
-def search_knowledge_base(query: str) -> str:
+@_cached_with_ttl
+async def search_knowledge_base(query: str) -> str:
     """
     Searches the ChromaDB vector store for past emails
     using semantic similarity. Use this when the user wants
@@ -570,7 +779,7 @@ def search_knowledge_base(query: str) -> str:
     even without remembering exact words or sender.
     This is the grounding tool that searches indexed email history.
     """
-    return kb_search(query)
+    return await asyncio.to_thread(kb_search, query)
 
 
 # ══════════════════════════════════════════
@@ -0,0 +1,133 @@
+# vector_store/backends.py
+# Exact in-memory search for small knowledge bases
+# For a few thousand emails, one matrix-vector product over every
+# stored embedding is faster than ChromaDB's HNSW index, and it
+# always finds the true nearest neighbours
+
+import os
+import glob
+import json
+import time
+import numpy as np
+from vector_store.fileio import atomic_write_text
+
+# Up to this many emails, exact in-memory search is faster than HNSW
+FLAT_SEARCH_MAX = 10_000
+
+# Saved next to the ChromaDB files so a new process can memory-map
+# the vectors instead of reading them back out of ChromaDB.
+# Every save writes a new vecs-<n>.npy, named in metas.json: a running
+# agent keeps its old file mapped, and Windows won't let another
+# process replace or delete a mapped file
+VECTORS_PREFIX = "vecs-"
+METAS_FILE = "metas.json"
+
+
+class FlatIPBackend:
+    """
+    Brute-force inner-product index over a (N, dim) float32 matrix,
+    the same idea as FAISS IndexFlatIP. Embeddings are normalised,
+    so inner product is cosine similarity.
+    """
+
+    def __init__(self, dim: int = 384):
+        self.vectors = np.empty((0, dim), dtype=np.float32)
+        self.ids = []
+        self.documents = []
+        self.metadatas = []
+
+    def __len__(self) -> int:
+        return len(self.ids)
+
+    def add(self, vecs, ids: list, documents: list, metadatas: list):
+        vecs = np.asarray(vecs, dtype=np.float32)
+        self.vectors = np.vstack([self.vectors, vecs])
+        self.ids.extend(ids)
+        self.documents.extend(documents)
+        self.metadatas.extend(metadatas)
+
+    def query(self, query_embeddings, n_results: int) -> dict:
+        """
+        Returns the n_results best matches in the same shape as
+        ChromaDB's collection.query, so callers can use either.
+        """
+        qvec = np.asarray(query_embeddings, dtype=np.float32).reshape(-1)
+        scores = self.vectors @ qvec
+        k = min(n_results, len(scores))
+        if k == 0:
+            return {"ids": [[]], "documents": [[]], "metadatas": [[]]}
+
+        # Partial sort for the top k, then order just those
+        top = np.argpartition(-scores, k - 1)[:k]
+        top = top[np.argsort(-scores[top])]
+
+        return {
+            "ids": [[self.ids[i] for i in top]],
+            "documents": [[self.documents[i] for i in top]],
+            "metadatas": [[self.metadatas[i] for i in top]],
+            "distances": [(1.0 - scores[top]).tolist()],
+        }
+
+    def save(self, directory: str):
+        """Writes the index to directory, replacing any old copy atomically."""
+        vecs_file = f"{VECTORS_PREFIX}{time.time_ns()}.npy"
+        vecs_path = os.path.join(directory, vecs_file)
+        metas_path = os.path.join(directory, METAS_FILE)
+
+        with open(vecs_path, "wb") as f:
+            np.save(f, np.ascontiguousarray(self.vectors, dtype=np.float32))
+        # Swapping metas.json is what switches readers to the new vectors
+        atomic_write_text(metas_path, json.dumps({
+            "vectors_file": vecs_file,
+            "ids": self.ids,
+            "documents": self.documents,
+            "metadatas": self.metadatas,
+        }))
+
+        # Old copies still mapped by a running agent can't be removed
+        # yet on Windows; a later save will clean them up
+        pattern = os.path.join(directory, VECTORS_PREFIX + "*.npy")
+        for old_path in glob.glob(pattern):
+            if old_path != vecs_path:
+                try:
+                    os.remove(old_path)
+                except OSError:
+                    pass
+
+    @classmethod
+    def load(cls, directory: str):
+        """
+        Opens a saved index with the vectors memory-mapped, so startup
+        cost doesn't grow with the number of emails. Returns None if
+        there is no saved index or its files don't match.
+        """
+        metas_path = os.path.join(directory, METAS_FILE)
+        if not os.path.exists(metas_path):
+            return None
+        with open(metas_path) as f:
+            metas = json.load(f)
+
+        vecs_path = os.path.join(directory, metas.get("vectors_file", ""))
+        if not os.path.isfile(vecs_path):
+            return None
+
+        vectors = np.load(vecs_path, mmap_mode="r")
+        if vectors.ndim != 2 or len(vectors) != len(metas["ids"]):
+            return None
+
+        backend = cls(dim=vectors.shape[1])
+        backend.vectors = vectors
+        backend.ids = metas["ids"]
+        backend.documents = metas["documents"]
+        backend.metadatas = metas["metadatas"]
+        return backend
+
+    @classmethod
+    def from_collection(cls, collection) -> "FlatIPBackend":
+        """Loads every stored email from a ChromaDB collection."""
+        data = collection.get(include=["embeddings", "documents", "metadatas"])
+        vecs = np.asarray(data["embeddings"], dtype=np.float32)
+        backend = cls(dim=vecs.shape[1] if vecs.ndim == 2 else 384)
+        if len(data["ids"]):
+            backend.add(vecs, data["ids"], data["documents"], data["metadatas"])
+        return backend
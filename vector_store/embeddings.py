@@ -3,6 +3,12 @@
 # This model converts text (emails) into numbers (vectors)
 # so ChromaDB can find similar emails by meaning
 
+import os
+import platform
+from functools import lru_cache
+
+import numpy as np
+import torch
 from sentence_transformers import SentenceTransformer
 
 # We use this specific model because it is:
@@ -11,13 +17,101 @@ from sentence_transformers import SentenceTransformer
 # - Small enough to run on a student laptop
 EMBEDDING_MODEL_NAME = "all-MiniLM-L6-v2"
 
+# Email subjects and snippets are short, so 128 tokens is plenty
+# and keeps attention cost low on unusually long inputs
+MAX_SEQ_LENGTH = 128
+
+
+def _cpu_supports_bf16() -> bool:
+    check = getattr(torch.cpu, "_is_avx512_bf16_supported", None)
+    return bool(check and check())
+
+
+# "torch" (default) or "onnx". The ONNX backend runs the INT8
+# quantised export that ships with the model on ONNX Runtime,
+# which is several times faster on CPU. It needs the extra
+# package: pip install "optimum[onnxruntime]"
+EMBEDDING_BACKEND = os.getenv("EMBEDDING_BACKEND", "torch")
+
+# The INT8 exports only have CPU kernels, so a GPU gets the
+# full-precision export instead
+ONNX_GPU_MODEL_FILE = "onnx/model.onnx"
+ONNX_ARM64_MODEL_FILE = "onnx/model_qint8_arm64.onnx"
+ONNX_X86_MODEL_FILE = "onnx/model_qint8_avx2.onnx"
+
+
+def _onnx_model_file(device: str) -> str:
+    if device == "cuda":
+        return ONNX_GPU_MODEL_FILE
+    if platform.machine().lower() in ("arm64", "aarch64"):
+        return ONNX_ARM64_MODEL_FILE
+    return ONNX_X86_MODEL_FILE
+
+
+def _load_onnx_model(device: str):
+    provider = (
+        "CUDAExecutionProvider" if device == "cuda"
+        else "CPUExecutionProvider"
+    )
+    return SentenceTransformer(
+        EMBEDDING_MODEL_NAME,
+        backend="onnx",
+        model_kwargs={
+            "file_name": _onnx_model_file(device),
+            "provider": provider,
+        },
+    )
+
+
+@lru_cache(maxsize=1)
 def get_embedding_model():
     """
     Loads and returns the sentence transformer model.
     First run will download the model (~90MB).
-    After that it loads from local cache instantly.
+    The model is loaded once per process and reused after that.
     """
-    print(f"Loading embedding model: {EMBEDDING_MODEL_NAME}")
-    model = SentenceTransformer(EMBEDDING_MODEL_NAME)
+    device = "cuda" if torch.cuda.is_available() else "cpu"
+    print(
+        f"Loading embedding model: {EMBEDDING_MODEL_NAME} "
+        f"({EMBEDDING_BACKEND}, {device})"
+    )
+
+    if EMBEDDING_BACKEND == "onnx":
+        model = _load_onnx_model(device)
+        model.max_seq_length = MAX_SEQ_LENGTH
+        print("Embedding model loaded successfully.")
+        return model
+
+    model = SentenceTransformer(EMBEDDING_MODEL_NAME, device=device)
+
+    # Half precision halves the weight size and uses faster kernels
+    if device == "cuda":
+        model.half()
+    elif _cpu_supports_bf16():
+        model.to(torch.bfloat16)
+
+    model.max_seq_length = MAX_SEQ_LENGTH
+    # Inference only - disable dropout and other training behaviour
+    model.eval()
     print("Embedding model loaded successfully.")
-    return model
\ No newline at end of file
+    return model
+
+
+def encode_batch(
+    texts: list[str], batch_size: int = 64, show_progress_bar: bool = False
+) -> np.ndarray:
+    """
+    Embeds many texts in batched forward passes.
+    Always prefer this over calling encode() once per email.
+    Vectors are L2-normalised, so a dot product is cosine similarity.
+    encode() sorts texts by length before batching and restores the
+    original order afterwards, so mixing short and long emails does
+    not waste compute on padding.
+    """
+    return get_embedding_model().encode(
+        texts,
+        batch_size=batch_size,
+        convert_to_numpy=True,
+        normalize_embeddings=True,
+        show_progress_bar=show_progress_bar,
+    )
@@ -0,0 +1,15 @@
+# vector_store/fileio.py
+# Small file helpers shared by the agent and the vector store
+
+import os
+
+
+def atomic_write_text(path: str, text: str):
+    """
+    Writes text to path via a temp file and a rename, so a crash
+    mid-write leaves either the old file or the new one, never half.
+    """
+    tmp_path = path + ".tmp"
+    with open(tmp_path, "w") as f:
+        f.write(text)
+    os.replace(tmp_path, path)
@@ -5,13 +5,21 @@
 # so we can later search them by meaning
 
 import os
-import pickle
+import json
+from dataclasses import dataclass
+from typing import Optional
 from dotenv import load_dotenv
 from googleapiclient.discovery import build
+from googleapiclient.errors import HttpError
 from google_auth_oauthlib.flow import InstalledAppFlow
 from google.auth.transport.requests import Request
+from google.oauth2.credentials import Credentials
 import chromadb
-from vector_store.embeddings import get_embedding_model
+import numpy as np
+from tqdm import tqdm
+from vector_store.embeddings import encode_batch
+from vector_store.backends import FlatIPBackend, FLAT_SEARCH_MAX
+from vector_store.fileio import atomic_write_text
 
 load_dotenv()
 
@@ -24,21 +32,52 @@ CHROMA_DB_PATH = "chroma_db"
 # Name of the collection inside ChromaDB (like a table in a database)
 COLLECTION_NAME = "buraq_emails"
 
+# Gmail rate-limits batches bigger than 50 sub-requests
+GMAIL_BATCH_SIZE = 50
+
+# Rows per collection.add call - bounds peak memory on big ingests
+CHROMA_ADD_BATCH_SIZE = 5000
+
+# Remembers the Gmail historyId of the last sync, so the next
+# ingest only asks Gmail for mail that arrived since then.
+# Kept inside chroma_db/ so deleting the database also resets it
+SYNC_STATE_PATH = os.path.join(CHROMA_DB_PATH, "sync_state.json")
+
+
+@dataclass(slots=True)
+class Email:
+    """One fetched email - slots keep large fetches light on memory."""
+    id: str
+    subject: str
+    sender: str
+    date: str
+    snippet: str
+    # Milliseconds since epoch when Gmail received the email
+    internal_date: int = 0
+
+
+# Built once per process - rebuilding parses the discovery document again
+_gmail_service = None
+
 
 def get_gmail_service():
     """
     Authenticates with Gmail API using OAuth2.
     First run: opens browser for Google login.
-    After that: uses saved token.pickle automatically.
+    After that: uses saved token.json automatically.
+    The service is reused for the rest of the process.
     """
+    global _gmail_service
+    if _gmail_service is not None:
+        return _gmail_service
+
     creds = None
-    token_path = "token.pickle"
+    token_path = "token.json"
     creds_path = os.getenv("GOOGLE_CLIENT_SECRET_FILE", "credentials.json")
 
     # Load saved token if it exists
     if os.path.exists(token_path):
-        with open(token_path, "rb") as f:
-            creds = pickle.load(f)
+        creds = Credentials.from_authorized_user_file(token_path)
 
     # If no valid credentials, ask user to login
     if not creds or not creds.valid:
@@ -49,140 +88,364 @@ def get_gmail_service():
             creds = flow.run_local_server(port=0)
 
         # Save token for next time
-        with open(token_path, "wb") as f:
-            pickle.dump(creds, f)
+        atomic_write_text(token_path, creds.to_json())
+
+    _gmail_service = build("gmail", "v1", credentials=creds)
+    return _gmail_service
+
+
+def load_sync_state() -> dict:
+    if not os.path.exists(SYNC_STATE_PATH):
+        return {}
+    with open(SYNC_STATE_PATH) as f:
+        return json.load(f)
+
+
+def save_sync_state(state: dict):
+    os.makedirs(CHROMA_DB_PATH, exist_ok=True)
+    atomic_write_text(SYNC_STATE_PATH, json.dumps(state))
+
+
+def get_current_history_id() -> str:
+    """Returns the mailbox's latest historyId - the next sync starts here."""
+    service = get_gmail_service()
+    profile = service.users().getProfile(
+        userId="me", fields="historyId"
+    ).execute()
+    return profile["historyId"]
+
+
+def _list_new_message_ids(service, start_history_id: str):
+    """
+    Lists every message added to the inbox since start_history_id,
+    newest first. Nothing is capped, so the sync point can safely
+    move past all of them. Returns None if Gmail no longer has
+    history that old, in which case the caller should do a full list.
+    """
+    messages = []
+    page_token = None
+    try:
+        while True:
+            results = service.users().history().list(
+                userId="me",
+                startHistoryId=start_history_id,
+                historyTypes=["messageAdded"],
+                labelId="INBOX",
+                pageToken=page_token,
+                fields="history(messagesAdded/message/id),nextPageToken"
+            ).execute()
+
+            for record in results.get("history", []):
+                for added in record.get("messagesAdded", []):
+                    messages.append({"id": added["message"]["id"]})
+
+            page_token = results.get("nextPageToken")
+            if not page_token:
+                break
+    except HttpError as e:
+        if e.resp.status == 404:
+            return None
+        raise
+
+    # History is oldest first - return newest first like messages.list
+    seen = set()
+    newest_first = []
+    for msg in reversed(messages):
+        if msg["id"] not in seen:
+            seen.add(msg["id"])
+            newest_first.append(msg)
+    return newest_first
+
+
+def _list_inbox_ids(
+    service, max_results: Optional[int], query: Optional[str] = None
+) -> list[dict]:
+    # Get list of message IDs, page by page
+    # Gmail returns at most 500 IDs per page
+    # max_results=None lists every match
+    messages = []
+    page_token = None
+    while max_results is None or len(messages) < max_results:
+        remaining = 500 if max_results is None else max_results - len(messages)
+        results = service.users().messages().list(
+            userId="me",
+            labelIds=["INBOX"],
+            maxResults=min(remaining, 500),
+            q=query,
+            pageToken=page_token,
+            fields="messages(id),nextPageToken"
+        ).execute()
+
+        messages.extend(results.get("messages", []))
+        page_token = results.get("nextPageToken")
+        if not page_token:
+            break
 
-    return build("gmail", "v1", credentials=creds)
+    return messages
 
 
-def fetch_emails(max_results: int = 50) -> list[dict]:
+def _fetch_metadata(service, messages: list[dict]) -> tuple[list[Email], bool]:
     """
-    Fetches recent emails from Gmail inbox.
-    Returns a list of dicts with id, subject, sender, date, snippet.
-    
-    Args:
-        max_results: How many emails to fetch (default 50)
+    Fetches metadata for the given messages in batches.
+    Returns the emails plus whether every message was accounted for;
+    messages deleted since they were listed don't count as failures.
     """
-    print(f"Fetching {max_results} emails from Gmail...")
-    service = get_gmail_service()
+    # Collected by the batch callback, keyed by message ID
+    fetched = {}
+    failed = []
+    # tqdm rate-limits its own redraws, unlike a print per email
+    progress = tqdm(total=len(messages), desc="Fetching", unit="email")
+
+    def _collect(request_id, response, exception):
+        progress.update(1)
+        if exception is not None:
+            progress.write(f"  Skipping email {request_id}: {exception}")
+            deleted = (
+                isinstance(exception, HttpError)
+                and exception.resp.status == 404
+            )
+            if not deleted:
+                failed.append(request_id)
+            return
+
+        headers = {h["name"]: h["value"] for h in response["payload"]["headers"]}
+
+        fetched[request_id] = Email(
+            id=request_id,
+            subject=headers.get("Subject", "No Subject"),
+            sender=headers.get("From", "Unknown"),
+            date=headers.get("Date", ""),
+            snippet=response.get("snippet", ""),
+            internal_date=int(response.get("internalDate", 0)),
+        )
 
-    # Get list of message IDs
-    results = service.users().messages().list(
-        userId="me",
-        labelIds=["INBOX"],
-        maxResults=max_results
-    ).execute()
+    # Fetch metadata in batches - one HTTP round-trip per batch
+    # instead of one per email
+    for start in range(0, len(messages), GMAIL_BATCH_SIZE):
+        batch = service.new_batch_http_request(callback=_collect)
+        for msg in messages[start:start + GMAIL_BATCH_SIZE]:
+            batch.add(
+                service.users().messages().get(
+                    userId="me",
+                    id=msg["id"],
+                    format="metadata",
+                    metadataHeaders=["Subject", "From", "Date"],
+                    fields="id,internalDate,snippet,payload/headers"
+                ),
+                request_id=msg["id"],
+            )
+        batch.execute()
+    progress.close()
+
+    # Keep the inbox order returned by the list call
+    emails = [fetched[msg["id"]] for msg in messages if msg["id"] in fetched]
+
+    print(f"Fetched {len(emails)} emails successfully.")
+    return emails, not failed
+
+
+def _fetch_emails_checked(
+    max_results: int,
+    start_history_id: Optional[str],
+    after_epoch: Optional[int],
+) -> tuple[list[Email], bool]:
+    """
+    Does the work of fetch_emails(), and also reports whether the
+    fetch was complete - i.e. whether the sync point may advance.
+    """
+    service = get_gmail_service()
 
-    messages = results.get("messages", [])
+    messages = None
+    if start_history_id is not None:
+        print("Checking Gmail for new emails since last sync...")
+        messages = _list_new_message_ids(service, start_history_id)
+        if messages is None:
+            print("Sync history expired, doing a full fetch instead.")
+
+    if messages is None and after_epoch:
+        # Let Gmail skip everything we already have. Everything newer
+        # is listed, since the sync point moves past all of it
+        print("Fetching emails received since last sync from Gmail...")
+        messages = _list_inbox_ids(service, None, f"after:{after_epoch}")
+    elif messages is None:
+        print(f"Fetching {max_results} emails from Gmail...")
+        messages = _list_inbox_ids(service, max_results)
 
     if not messages:
         print("No emails found.")
-        return []
-
-    emails = []
-    for i, msg in enumerate(messages):
-        print(f"  Fetching email {i+1}/{len(messages)}...", end="\r")
-        
-        # Get full email data
-        data = service.users().messages().get(
-            userId="me",
-            id=msg["id"],
-            format="metadata",
-            metadataHeaders=["Subject", "From", "Date"]
-        ).execute()
+        return [], True
 
-        headers = {h["name"]: h["value"] for h in data["payload"]["headers"]}
+    return _fetch_metadata(service, messages)
 
-        emails.append({
-            "id": msg["id"],
-            "subject": headers.get("Subject", "No Subject"),
-            "sender": headers.get("From", "Unknown"),
-            "date": headers.get("Date", ""),
-            "snippet": data.get("snippet", ""),
-        })
 
-    print(f"\nFetched {len(emails)} emails successfully.")
+def fetch_emails(
+    max_results: int = 50,
+    start_history_id: Optional[str] = None,
+    after_epoch: Optional[int] = None,
+) -> list[Email]:
+    """
+    Fetches recent emails from Gmail inbox.
+    Returns a list of Email objects with id, subject, sender, date, snippet.
+    
+    Args:
+        max_results: How many emails to fetch (default 50)
+        start_history_id: If given, fetch every email added since
+            this Gmail historyId instead
+        after_epoch: If given, a full fetch only lists emails received
+            after this Unix time (seconds)
+    """
+    emails, _ = _fetch_emails_checked(
+        max_results, start_history_id, after_epoch
+    )
     return emails
 
 
+def _advance_sync_state(
+    state: dict, history_id: str, emails: list[Email], complete: bool
+):
+    # If some emails could not be fetched, keep the old sync point
+    # so the next ingest asks Gmail for them again
+    if not complete:
+        print("Some emails could not be fetched; they will be retried.")
+        return
+    state["history_id"] = history_id
+    newest = max((email.internal_date for email in emails), default=0)
+    state["last_internal_date"] = max(
+        state.get("last_internal_date", 0), newest
+    )
+    save_sync_state(state)
+
+
 def ingest_emails_to_chromadb(max_results: int = 50):
     """
     Main ingestion pipeline:
     1. Fetch emails from Gmail
     2. Create text representation of each email
-    3. Embed each email using sentence-transformers
+    3. Embed all new emails in batches using sentence-transformers
     4. Store in ChromaDB for semantic search
     
     Args:
         max_results: Number of emails to ingest
     """
-    # Step 1: Fetch emails
-    emails = fetch_emails(max_results)
-    if not emails:
-        print("No emails to ingest.")
-        return
-
-    # Step 2: Load embedding model
-    model = get_embedding_model()
-
-    # Step 3: Set up ChromaDB
+    # Step 1: Set up ChromaDB
     client = chromadb.PersistentClient(path=CHROMA_DB_PATH)
     
     # Get or create collection
     # If it already exists we use it, otherwise create fresh
+    # HNSW settings only apply when the collection is first created
     collection = client.get_or_create_collection(
         name=COLLECTION_NAME,
-        metadata={"description": "Buraq email knowledge base"}
+        metadata={
+            "description": "Buraq email knowledge base",
+            # Embeddings are L2-normalised, so inner product equals
+            # cosine similarity without re-normalising every vector
+            "hnsw:space": "ip",
+            # Denser graph + wider build search = better recall,
+            # cheap for a read-mostly inbox index
+            "hnsw:M": 32,
+            "hnsw:construction_ef": 200,
+            "hnsw:search_ef": 100,
+        }
+    )
+
+    # Step 2: Fetch emails
+    # Only new mail since the last sync, when we have one on record.
+    # An empty collection means the knowledge base was reset, so the
+    # old sync point no longer describes what is stored
+    sync_state = load_sync_state()
+    if collection.count() == 0:
+        sync_state.pop("history_id", None)
+        sync_state.pop("last_internal_date", None)
+
+    # The history ID is read first so nothing arriving mid-ingest
+    # is skipped next time
+    history_id = get_current_history_id()
+    last_internal_date = sync_state.get("last_internal_date")
+    emails, complete = _fetch_emails_checked(
+        max_results,
+        start_history_id=sync_state.get("history_id"),
+        after_epoch=last_internal_date // 1000 if last_internal_date else None,
     )
+    if not emails:
+        _advance_sync_state(sync_state, history_id, emails, complete)
+        print("No emails to ingest.")
+        return
 
-    # Step 4: Prepare data for ChromaDB
+    # Step 3: Prepare data for ChromaDB
     documents = []   # The text we embed and search
     metadatas = []   # Extra info stored alongside each document
     ids = []         # Unique ID for each document
 
     # Get IDs already in the database to avoid duplicates
-    existing = collection.get()["ids"]
+    # Only look up the emails we just fetched, and skip
+    # transferring their embeddings/documents/metadata
+    existing = set(collection.get(
+        ids=[email.id for email in emails],
+        include=[]
+    )["ids"])
 
     new_count = 0
     for email in emails:
         # Skip if already ingested
-        if email["id"] in existing:
+        if email.id in existing:
             continue
 
         # Create a searchable text representation of the email
         # This is what gets embedded and searched
-        doc_text = (
-            f"Subject: {email['subject']}\n"
-            f"From: {email['sender']}\n"
-            f"Date: {email['date']}\n"
-            f"Content: {email['snippet']}"
-        )
+        # Only subject + content are embedded: sender and date are
+        # kept in metadatas for display, and would otherwise add
+        # noisy tokens that dilute the meaning of short snippets
+        doc_text = f"{email.subject}\n{email.snippet[:512]}"
 
         documents.append(doc_text)
         metadatas.append({
-            "email_id": email["id"],
-            "subject": email["subject"],
-            "sender": email["sender"],
-            "date": email["date"],
+            "email_id": email.id,
+            "subject": email.subject,
+            "sender": email.sender,
+            "date": email.date,
+            "snippet": email.snippet[:200],
         })
-        ids.append(email["id"])
+        ids.append(email.id)
         new_count += 1
 
     if not documents:
+        _advance_sync_state(sync_state, history_id, emails, complete)
         print("All emails already ingested. Database is up to date.")
         return
 
-    # Step 5: Generate embeddings for all documents
+    # Step 4: Generate embeddings for all documents in one batched pass
     print(f"Embedding {new_count} new emails...")
-    embeddings = model.encode(documents, show_progress_bar=True).tolist()
-
-    # Step 6: Add to ChromaDB
-    collection.add(
-        documents=documents,
-        embeddings=embeddings,
-        metadatas=metadatas,
-        ids=ids
-    )
+    # Kept as a float32 array - Chroma accepts it directly, so there is
+    # no need to build a nested Python list of floats
+    embeddings = encode_batch(
+        documents, batch_size=64, show_progress_bar=True
+    ).astype(np.float32, copy=False)
+
+    # Step 5: Add to ChromaDB
+    for start in range(0, len(ids), CHROMA_ADD_BATCH_SIZE):
+        end = start + CHROMA_ADD_BATCH_SIZE
+        collection.add(
+            documents=documents[start:end],
+            embeddings=embeddings[start:end],
+            metadatas=metadatas[start:end],
+            ids=ids[start:end]
+        )
+
+    # Step 6: Save a flat copy of the vectors that search can
+    # memory-map on startup instead of reading ChromaDB
+    # Only the new emails are appended to the saved copy; it is
+    # rebuilt from ChromaDB when missing or out of step with it
+    total = collection.count()
+    if total <= FLAT_SEARCH_MAX:
+        flat_index = FlatIPBackend.load(CHROMA_DB_PATH)
+        if flat_index is not None and len(flat_index) + len(ids) == total:
+            flat_index.add(embeddings, ids, documents, metadatas)
+        else:
+            flat_index = FlatIPBackend.from_collection(collection)
+        flat_index.save(CHROMA_DB_PATH)
+
+    # Only advance the sync point once the emails are safely stored
+    _advance_sync_state(sync_state, history_id, emails, complete)
 
     print(f"\nSuccessfully ingested {new_count} emails into ChromaDB.")
     print(f"Total emails in knowledge base: {collection.count()}")
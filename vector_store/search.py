@@ -2,63 +2,159 @@
 # Semantic search over ChromaDB + AI-powered conversational response
 
 import os
+from functools import lru_cache
+from concurrent.futures import ThreadPoolExecutor
+from typing import Callable, Optional
+
 import chromadb
 from groq import Groq
 from dotenv import load_dotenv
-from vector_store.embeddings import get_embedding_model
+from vector_store.embeddings import encode_batch
+from vector_store import semantic_cache
+from vector_store.backends import FlatIPBackend, FLAT_SEARCH_MAX
 
 load_dotenv()
 
 CHROMA_DB_PATH = "chroma_db"
 COLLECTION_NAME = "buraq_emails"
 
+# Opened once and reused by every query in this process
+_client = None
+_collection = None
+_groq = None
+
+_flat_index = None
+
+# Used on the first query to open ChromaDB and embed at the same time
+_startup_pool = ThreadPoolExecutor(max_workers=2)
+
+
+def _get_groq():
+    """Returns a shared Groq client so its connection pool is reused."""
+    global _groq
+    if _groq is None:
+        _groq = Groq(api_key=os.getenv("GROQ_API_KEY"))
+    return _groq
+
+
+def _get_collection():
+    """
+    Returns the email collection, opening ChromaDB on first use.
+    Returns None if the collection does not exist yet, without
+    caching that result so a later ingest is picked up.
+    """
+    global _client, _collection
+    if _collection is None:
+        if _client is None:
+            _client = chromadb.PersistentClient(path=CHROMA_DB_PATH)
+        try:
+            _collection = _client.get_collection(name=COLLECTION_NAME)
+        except Exception:
+            return None
+    return _collection
+
+
+@lru_cache(maxsize=1024)
+def _encode_query(query: str) -> tuple:
+    """Embeds a query once; repeats of the same text skip the model."""
+    return tuple(encode_batch([query])[0].tolist())
+
 
-def search_knowledge_base(query: str, n_results: int = 3) -> str:
+def _get_flat_index(collection, total: int) -> FlatIPBackend:
+    """
+    Returns the in-memory copy of the collection. It is memory-mapped
+    from the copy saved by ingest when possible, and rebuilt from
+    ChromaDB when missing or out of date.
+    """
+    global _flat_index
+    if _flat_index is None:
+        _flat_index = FlatIPBackend.load(CHROMA_DB_PATH)
+    if _flat_index is None or len(_flat_index) != total:
+        _flat_index = FlatIPBackend.from_collection(collection)
+        _flat_index.save(CHROMA_DB_PATH)
+    return _flat_index
+
+
+def search_knowledge_base(
+    query: str,
+    n_results: int = 3,
+    stream_callback: Optional[Callable[[str], None]] = None,
+) -> str:
     """
     Searches ChromaDB for relevant emails and returns
     a natural language AI response based on what was found.
+    If stream_callback is given, the response is also passed to it
+    piece by piece as Groq generates it.
     """
-    # Step 1 — Load ChromaDB
-    client = chromadb.PersistentClient(path=CHROMA_DB_PATH)
+    def _reply(text: str) -> str:
+        # Answers that don't come from Groq are sent in one piece
+        if stream_callback is not None:
+            stream_callback(text)
+        return text
 
-    try:
-        collection = client.get_collection(name=COLLECTION_NAME)
-    except Exception:
-        return "Knowledge base is empty. Please run ingest.py first."
-
-    if collection.count() == 0:
-        return "Knowledge base is empty. Please run ingest.py first."
+    # Step 1 — Load ChromaDB
+    # On a cold start, embed the query while ChromaDB opens
+    embedding_future = None
+    if _collection is None:
+        embedding_future = _startup_pool.submit(_encode_query, query)
+        collection = _startup_pool.submit(_get_collection).result()
+    else:
+        collection = _collection
+    if collection is None:
+        return _reply("Knowledge base is empty. Please run ingest.py first.")
+
+    # Counted once - each count() is a round-trip into Chroma
+    total = collection.count()
+    if total == 0:
+        return _reply("Knowledge base is empty. Please run ingest.py first.")
 
     # Step 2 — Embed the query and search
-    model = get_embedding_model()
-    query_embedding = model.encode([query]).tolist()
-
-    results = collection.query(
-        query_embeddings=query_embedding,
-        n_results=min(n_results, collection.count())
-    )
+    if embedding_future is not None:
+        query_embedding = [list(embedding_future.result())]
+    else:
+        query_embedding = [list(_encode_query(query))]
+
+    # Reuse the answer to a near-identical earlier question,
+    # as long as no emails were ingested since it was answered
+    cached = semantic_cache.lookup(query_embedding, total)
+    if cached is not None:
+        return _reply(cached)
+
+    # Small knowledge bases use exact flat search, large ones HNSW
+    if total <= FLAT_SEARCH_MAX:
+        results = _get_flat_index(collection, total).query(
+            query_embedding, n_results
+        )
+    else:
+        results = collection.query(
+            query_embeddings=query_embedding,
+            n_results=min(n_results, total)
+        )
 
     if not results["documents"][0]:
-        return f"No emails found matching: '{query}'"
+        return _reply(f"No emails found matching: '{query}'")
 
     # Step 3 — Build context from retrieved emails
     context = ""
     for i, (doc, meta) in enumerate(
         zip(results["documents"][0], results["metadatas"][0])
     ):
+        # Emails ingested before snippets were stored in metadata
+        # only have it inside the document text
+        preview = meta.get("snippet")
+        if preview is None:
+            preview = doc.rpartition("Content:")[2].strip()[:200]
         context += (
             f"Email {i+1}:\n"
             f"  Subject: {meta.get('subject', 'N/A')}\n"
             f"  From: {meta.get('sender', 'N/A')}\n"
             f"  Date: {meta.get('date', 'N/A')}\n"
-            f"  Preview: {doc.split('Content:')[-1].strip()[:200]}\n\n"
+            f"  Preview: {preview}\n\n"
         )
 
     # Step 4 — Ask Groq LLM to answer the user's question
     # based on the emails we retrieved
-    groq_client = Groq(api_key=os.getenv("GROQ_API_KEY"))
-
-    response = groq_client.chat.completions.create(
+    response = _get_groq().chat.completions.create(
         model="llama-3.3-70b-versatile",
         messages=[
             {
@@ -80,10 +176,22 @@ def search_knowledge_base(query: str, n_results: int = 3) -> str:
                     f"Relevant emails found:\n{context}"
                 )
             }
-        ]
+        ],
+        stream=stream_callback is not None,
     )
 
-    return response.choices[0].message.content
+    if stream_callback is None:
+        answer = response.choices[0].message.content
+    else:
+        parts = []
+        for chunk in response:
+            token = chunk.choices[0].delta.content or ""
+            if token:
+                stream_callback(token)
+                parts.append(token)
+        answer = "".join(parts)
+    semantic_cache.store(query, query_embedding, answer, total)
+    return answer
 
 
 if __name__ == "__main__":
@@ -100,7 +208,10 @@ if __name__ == "__main__":
         if not query:
             continue
 
-        print("\nBuraq: thinking...\n")
-        response = search_knowledge_base(query)
-        print(f"Buraq: {response}\n")
+        print("\nBuraq: ", end="", flush=True)
+        search_knowledge_base(
+            query,
+            stream_callback=lambda t: print(t, end="", flush=True),
+        )
+        print("\n")
         print("-" * 40)
\ No newline at end of file
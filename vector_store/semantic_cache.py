@@ -0,0 +1,76 @@
+# vector_store/semantic_cache.py
+# Semantic cache for knowledge base answers
+# Past questions and Buraq's answers are kept in a second ChromaDB
+# collection, so a near-duplicate question can reuse the stored
+# answer instead of calling the LLM again
+
+import time
+import uuid
+import chromadb
+
+CHROMA_DB_PATH = "chroma_db"
+CACHE_COLLECTION_NAME = "buraq_query_cache"
+
+# Distance (1 - cosine similarity) below this counts as the same question
+CACHE_DISTANCE_THRESHOLD = 0.15
+
+# Cached answers are ignored after 7 days
+CACHE_TTL_SECONDS = 7 * 24 * 60 * 60
+
+_cache_collection = None
+
+
+def _get_cache_collection():
+    global _cache_collection
+    if _cache_collection is None:
+        client = chromadb.PersistentClient(path=CHROMA_DB_PATH)
+        _cache_collection = client.get_or_create_collection(
+            name=CACHE_COLLECTION_NAME,
+            metadata={
+                "description": "Buraq knowledge base answer cache",
+                # Query embeddings are normalised, so inner
+                # product distance is the cosine distance
+                "hnsw:space": "ip",
+            }
+        )
+    return _cache_collection
+
+
+def lookup(query_embedding: list, kb_count: int) -> str | None:
+    """
+    Returns a cached answer for a question similar to this one,
+    or None if nothing close enough was asked in the last 7 days.
+    Answers given when the knowledge base held a different number
+    of emails are ignored, so each ingest invalidates the cache.
+    """
+    collection = _get_cache_collection()
+    if collection.count() == 0:
+        return None
+
+    results = collection.query(
+        query_embeddings=query_embedding,
+        n_results=1,
+        where={"$and": [
+            {"ts": {"$gte": time.time() - CACHE_TTL_SECONDS}},
+            {"kb_count": kb_count},
+        ]},
+    )
+
+    if not results["ids"][0]:
+        return None
+    if results["distances"][0][0] >= CACHE_DISTANCE_THRESHOLD:
+        return None
+    return results["metadatas"][0][0]["answer"]
+
+
+def store(query: str, query_embedding: list, answer: str, kb_count: int):
+    """
+    Saves a question and its answer for later lookups, stamped with
+    the knowledge base size it was answered from.
+    """
+    _get_cache_collection().add(
+        ids=[uuid.uuid4().hex],
+        documents=[query],
+        embeddings=query_embedding,
+        metadatas=[{"answer": answer, "ts": time.time(), "kb_count": kb_count}],
+    )